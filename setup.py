@@ -9,6 +9,7 @@ setup(
     author='Yoast',
     url='https://github.com/Yoast/target-bigquery',
     classifiers=['Programming Language :: Python :: 3 :: Only'],
+    python_requires='>=3.8',
     py_modules=['target_bigquery'],
     install_requires=[
         'google-api-python-client~=1.12.8',
@@ -16,7 +17,10 @@ setup(
         'google-cloud-bigquery~=2.8.0',
         'jsonschema~=2.6.0',
         'oauth2client~=4.1.3',
+        'orjson~=3.8.3',
+        'msgspec~=0.18.4',
         'singer-python~=5.10.0',
+        'urllib3>=1.26',
     ],
     entry_points="""
         [console_scripts]
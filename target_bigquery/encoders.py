@@ -5,19 +5,67 @@ import decimal
 import json
 from typing import Any
 
+import orjson
 
-class DecimalEncoder(json.JSONEncoder):
-    """Convert Decimal in JSON to string."""
 
-    def default(self, input_object: Any) -> Any:
-        """Convert Decimal objects to string.
+def decimal_default(input_object: Any) -> str:
+    """Convert Decimal objects to string, for use as orjson default.
 
-        Arguments:
-            input_object {Any} -- Input object
+    Arguments:
+        input_object {Any} -- Input object
 
-        Returns:
-            Any -- Output object
-        """
-        if isinstance(input_object, decimal.Decimal):
-            return str(input_object)
-        return super().default(input_object)
+    Raises:
+        TypeError: If the object is not a Decimal
+
+    Returns:
+        str -- Output string
+    """
+    if type(input_object) is decimal.Decimal:
+        return str(input_object)
+    raise TypeError(f'Type is not JSON serializable: {type(input_object)}')
+
+
+def decimal_to_str(input_object: Any) -> Any:
+    """Recursively convert Decimal objects to string.
+
+    Arguments:
+        input_object {Any} -- Input object
+
+    Returns:
+        Any -- Output object, with all Decimal values converted to string
+    """
+    # Parsed JSON only contains these exact types, so compare the type
+    # itself instead of using isinstance
+    input_type: type = type(input_object)
+    if input_type is dict:
+        return {
+            key: decimal_to_str(input_value)
+            for key, input_value in input_object.items()
+        }
+    elif input_type is list:
+        return [decimal_to_str(input_value) for input_value in input_object]
+    elif input_type is decimal.Decimal:
+        return str(input_object)
+    return input_object
+
+
+def json_line(input_object: Any) -> bytes:
+    """Serialize an object as a line of JSON, Decimal objects as string.
+
+    Arguments:
+        input_object {Any} -- Input object
+
+    Returns:
+        bytes -- JSON followed by a newline
+    """
+    try:
+        return orjson.dumps(
+            input_object,
+            default=decimal_default,
+            option=orjson.OPT_APPEND_NEWLINE,
+        )
+    except TypeError:
+        # orjson only serializes integers up to 64 bits, while a tap can send
+        # larger ones for NUMERIC and BIGNUMERIC columns
+        line: str = json.dumps(input_object, default=decimal_default)
+        return f'{line}\n'.encode('utf-8')
@@ -1,196 +1,390 @@
 """Load jobs into BigQuery."""
 # -*- coding: utf-8 -*-
-import json
+import gzip
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tempfile import TemporaryFile
-from typing import Iterator, Optional, TextIO, Union
+from types import SimpleNamespace
+from typing import Any, BinaryIO, Iterable, Iterator, Optional, Union
 
 from google.api_core import exceptions as google_exceptions
 from google.cloud.bigquery import LoadJob, LoadJobConfig, WriteDisposition
 from google.cloud.bigquery.client import Client
 from google.cloud.bigquery.dataset import Dataset
 from google.cloud.bigquery.job import SourceFormat
-from jsonschema import validate
-from singer import (  # noqa: I001
-    get_logger,  # noqa: I001
-    parse_message,  # noqa: I001
+from singer import get_logger
+
+from target_bigquery.encoders import json_line
+from target_bigquery.exceptions import SchemaNotFoundException
+from target_bigquery.messages import (  # noqa: I001
+    Message,  # noqa: I001
     RecordMessage,  # noqa: I001
     SchemaMessage,  # noqa: I001
     StateMessage,  # noqa: I001
+    parse_message,  # noqa: I001
 )  # noqa: I001
-
-from target_bigquery.encoders import DecimalEncoder
-from target_bigquery.exceptions import (  # noqa: I001
-    InvalidSingerMessage,  # noqa: I001
-    SchemaNotFoundException,  # noqa: I001
+from target_bigquery.schema import (  # noqa: I001
+    apply_compiled,  # noqa: I001
+    build_schema,  # noqa: I001
+    build_validator,  # noqa: I001
+    compile_schema,  # noqa: I001
 )  # noqa: I001
-from target_bigquery.schema import build_schema, filter_schema
 
 LOGGER: logging.RootLogger = get_logger()
+FILE_BUFFER_SIZE: int = 1024 * 1024
+WRITE_BATCH_SIZE: int = 1000
+MAX_LOAD_JOBS: int = 16
+COMPRESS_LEVEL: int = 1
 
 
-def persist_lines_job(  # noqa: WPS210, WPS211, WPS213, WPS231, WPS238
+def persist_lines_job(  # noqa: WPS211
     client: Client,
     dataset: Dataset,
-    lines: TextIO,
+    lines: BinaryIO,
     truncate: bool,
-    forced_fulltables: list,
+    forced_fulltables: Optional[Iterable[str]] = None,
     validate_records: bool = True,
     table_suffix: Optional[str] = None,
     table_prefix: Optional[str] = None,
+    max_file_size: Optional[int] = None,
+    compress_files: bool = False,
 ) -> Iterator[Optional[str]]:
     """Perform a load job into BigQuery.
 
     Arguments:
         client {Client} -- BigQuery client
         dataset {Dataset} -- BigQuery dataset
-        lines {TextIO} -- Tap stream
+        lines {BinaryIO} -- Tap stream
 
     Keyword Arguments:
         truncate {bool} -- Whether to truncunate the table
-        forced_fulltables {list} -- List of tables to truncunate
+        forced_fulltables {Optional[Iterable[str]]} -- Tables to truncunate
+        (default: {None})
         validate_records {bool} -- Whether to alidate records (default: {True})
         table_suffix {Optional[str]} -- Suffix for tables (default: {None})
         table_prefix {Optional[str]} -- Prefix for tables (default: {None})
+        max_file_size {Optional[int]} -- Uncompressed temp file size in bytes
+        from which the records are loaded, while the stream is still read.
+        Every part is committed by its own load job, so when a later part
+        or record fails, the earlier parts stay in the table without a state
+        and a rerun from the previous state loads them again. By default a
+        table is loaded by one job once all records are read. Does not apply
+        to truncated tables. With compress_files, a part has to stay under
+        the 4 GB BigQuery loads of a gzipped file (default: {None})
+        compress_files {bool} -- Whether to gzip the temp files, which makes
+        the upload several times smaller. BigQuery loads gzipped files of at
+        most 4 GB and can not read them in parallel, while uncompressed files
+        can be up to 5 TB. A table is only split by max_file_size, so without
+        it a table over 4 GB compressed fails to load (default: {False})
 
     Raises:
-        SchemaNotFoundException: If the schema message was not received yet
         InvalidSingerMessage: Invalid Sinnger message
 
     Yields:
         Iterator[Optional[str]] -- State
     """
-    # Create variable in which we save data in the upcomming loop
-    state: Optional[str] = None
-    schemas: dict = {}
-    key_properties: dict = {}
-    rows: dict = {}
-    errors: dict = {}
-    table_suffix = table_suffix or ''
-    table_prefix = table_prefix or ''
-
-    # For every Singer input message
-    for line in lines:
-        # Parse the message
-        try:
-            msg: Union[SchemaMessage, StateMessage, RecordMessage] = (
-                parse_message(line)
-            )
-        except json.decoder.JSONDecodeError:
-            LOGGER.error(f'Unable to parse Singer Message:\n{line}')
-            raise
-
-        # There can be several kind of messages. When inserting data, the
-        # schema message comes first
-        if isinstance(msg, SchemaMessage):
-            # Schema message, save schema
-            table_name: str = table_prefix + msg.stream + table_suffix
-
-            # Skip schema if already created
-            if table_name in rows:
+    # Create the context in which we save data in the upcomming loop
+    ctx: SimpleNamespace = SimpleNamespace(
+        client=client,
+        dataset=dataset,
+        truncate=truncate,
+        forced_fulltables=frozenset(forced_fulltables or ()),
+        validate_records=validate_records,
+        table_suffix=table_suffix or '',
+        table_prefix=table_prefix or '',
+        max_file_size=max_file_size,
+        compress_files=compress_files,
+        executor=None,
+        state=None,
+        table_names={},
+        schemas={},
+        bigquery_schemas={},
+        key_properties={},
+        validators={},
+        filters={},
+        rows={},
+        pending={},
+        errors={},
+        loads={},
+    )
+
+    # There can be several kind of messages, each has its own handler
+    handlers: dict = {
+        SchemaMessage: handle_schema_message,
+        RecordMessage: handle_record_message,
+        StateMessage: handle_state_message,
+    }
+
+    with ThreadPoolExecutor(max_workers=MAX_LOAD_JOBS) as executor:
+        ctx.executor = executor
+
+        # For every Singer input message
+        for line in lines:
+            # Parse the message, unknown message types raise
+            # InvalidSingerMessage
+            msg: Message = parse_message(line)
+            handlers[type(msg)](msg, ctx)
+
+        # After all recordsa are received, load the rest of every stream
+        for table in ctx.rows.keys():
+            # Write the records that are left
+            write_records(ctx.rows[table], ctx.pending[table])
+
+            # Skip the last file if it is empty and the table got loaded
+            if ctx.loads[table] and not ctx.rows[table].tell():
                 continue
 
-            # Save schema and setup a temp file for data storage
-            schemas[table_name] = msg.schema
-            key_properties[table_name] = msg.key_properties
-            rows[table_name] = TemporaryFile(mode='w+b')
-            errors[table_name] = None
-
-        elif isinstance(msg, RecordMessage):
-            # Record message
-            table_name = table_prefix + msg.stream + table_suffix
-
-            if table_name not in schemas:
-                raise SchemaNotFoundException(
-                    f'A record for stream {table_name} was encountered before '
-                    'a corresponding schema',
-                )
-
-            # Retrieve schema
-            schema: dict = schemas[table_name]
-
-            # Validate the record
-            if validate_records:
-                # Raises ValidationError if the record has invalid schema
-                validate(msg.record, schema)
-
-            record_input: Optional[Union[dict, str, list]] = filter_schema(
-                schema,
-                msg.record,
-            )
-
-            # Somewhere in the process, the input record can have decimal
-            # values e.g. "value": Decimal('10.25'). These are not JSON
-            # erializable. Therefore, we dump the JSON here, which converts
-            # them to string. Thereafter, we load the dumped JSON so we get a
-            # dictionary again, which we can insert to BigQuery
-            record_str: str = '{rec}\n'.format(
-                rec=json.dumps(record_input, cls=DecimalEncoder),
-            )
-
-            record: bytes = bytes(record_str, 'UTF-8')
-
-            # Save data to load later
-            rows[table_name].write(record)
-
-            state = None
-
-        elif isinstance(msg, StateMessage):
-            # State messages
-            LOGGER.debug(f'Setting state to {msg.value}')
-            state = msg.value
-
-        else:
-            raise InvalidSingerMessage(
-                f'Unrecognized Singer Message:\n {msg}',
-            )
-
-    # After all recordsa are received, setup a load job per stream
-    for table in rows.keys():
-        # Prepare load job
-        key_props: str = key_properties[table]
-        load_config: LoadJobConfig = LoadJobConfig()
-        load_config.schema = build_schema(
-            schemas[table],
-            key_properties=key_props,
-        )
-        load_config.source_format = SourceFormat.NEWLINE_DELIMITED_JSON
+            start_load(ctx, table)
+
+        # Raises the first error, after all load jobs are finished
+        table_loads: list = [
+            load for loads in ctx.loads.values() for load in loads
+        ]
+        for future in as_completed(table_loads):
+            future.result()
+
+    yield ctx.state
+
+
+def handle_schema_message(msg: SchemaMessage, ctx: SimpleNamespace) -> None:
+    """Save the schema of a stream and setup a temp file for its records.
+
+    When inserting data, the schema message comes first.
+
+    Arguments:
+        msg {SchemaMessage} -- Schema message
+        ctx {SimpleNamespace} -- Context of persist_lines_job
+    """
+    # Build the table name once, the records of the stream look it up
+    table_name: str = ctx.table_prefix + msg.stream + ctx.table_suffix
+    ctx.table_names[msg.stream] = table_name
+
+    # Skip schema if already created
+    if table_name in ctx.rows:
+        return
 
-        # Overwrite the table if truncate is enabled
-        if truncate or table in forced_fulltables:
-            LOGGER.info(f'Load {table} by FULL_TABLE')
-            load_config.write_disposition = WriteDisposition.WRITE_TRUNCATE
+    # Save schema and setup a temp file for data storage
+    ctx.schemas[table_name] = msg.schema
+    ctx.key_properties[table_name] = msg.key_properties
+    if ctx.validate_records:
+        ctx.validators[table_name] = build_validator(msg.schema)
+    ctx.filters[table_name] = compile_schema(msg.schema)
+    ctx.rows[table_name] = open_temp_file(ctx.compress_files)
+    ctx.pending[table_name] = []
+    ctx.errors[table_name] = None
+    ctx.loads[table_name] = []
 
-        LOGGER.info(f'loading {table} to Bigquery.')
 
-        # Setup load job
-        load_job: LoadJob = client.load_table_from_file(
-            rows[table],
-            dataset.table(table),
-            job_config=load_config,
-            rewind=True,
+def handle_record_message(msg: RecordMessage, ctx: SimpleNamespace) -> None:
+    """Filter a record and write it to the temp file of its table.
+
+    Arguments:
+        msg {RecordMessage} -- Record message
+        ctx {SimpleNamespace} -- Context of persist_lines_job
+
+    Raises:
+        SchemaNotFoundException: If the schema message was not received yet
+    """
+    table_name: Optional[str] = ctx.table_names.get(msg.stream)
+
+    if table_name is None:
+        raise SchemaNotFoundException(
+            f'A record for stream {msg.stream} was encountered before '
+            'a corresponding schema',
         )
 
-        LOGGER.info(f'loading job {load_job.job_id}')
-
-        # Run load job
-        try:
-            load_job.result()
-        except google_exceptions.GoogleAPICallError as err:
-            # Parse errors
-            LOGGER.error(f'failed to load table {table} from file: {err}')
-
-            if load_job.errors:
-                messages: list = [
-                    f"reason: {err['reason']}, message: {err['message']}"
-                    for err in load_job.errors
-                ]
-                messages_str: str = '\n'.join(messages)
-                LOGGER.error(f'errors:\n{messages_str}')
-            raise
-        LOGGER.info(
-            f'Loaded {load_job.output_rows} row(s) in '
-            f'{load_job.destination}',
+    # Validate the record, there is no validator when validation is disabled
+    # or the schema accepts every record
+    validator: Optional[Any] = ctx.validators.get(table_name)
+    if validator is not None:
+        # Raises ValidationError if the record has invalid schema
+        validator.validate(msg.record)
+
+    # Filter the record
+    record_input: Optional[Union[dict, str, list]] = apply_compiled(
+        ctx.filters[table_name],
+        msg.record,
+    )
+
+    # Save data to load later, the records are written to the temp file in
+    # batches
+    pending: list = ctx.pending[table_name]
+    pending.append(record_input)
+    if len(pending) >= WRITE_BATCH_SIZE:
+        write_records(ctx.rows[table_name], pending)
+        ctx.pending[table_name] = []
+
+        # Once the temp file is large enough, start loading the records
+        # received so far while reading the rest, when this is enabled.
+        # Tables that are truncated are only loaded once all records are read
+        # and validated, so a failure can not leave them with part of the data
+        temp_file_full: bool = (
+            ctx.max_file_size is not None
+            and ctx.rows[table_name].tell() >= ctx.max_file_size
+        )
+        if temp_file_full and not truncates_table(ctx, table_name):
+            start_load(ctx, table_name)
+            ctx.rows[table_name] = open_temp_file(ctx.compress_files)
+
+    ctx.state = None
+
+
+def handle_state_message(msg: StateMessage, ctx: SimpleNamespace) -> None:
+    """Save the state.
+
+    Arguments:
+        msg {StateMessage} -- State message
+        ctx {SimpleNamespace} -- Context of persist_lines_job
+    """
+    LOGGER.debug('Setting state to %s', msg.value)  # noqa: WPS323
+    ctx.state = msg.value
+
+
+def start_load(ctx: SimpleNamespace, table: str) -> None:
+    """Start loading the temp file of a table in the background.
+
+    Arguments:
+        ctx {SimpleNamespace} -- Context of persist_lines_job
+        table {str} -- Table name
+    """
+    # Prepare load job
+    load_config: LoadJobConfig = LoadJobConfig()
+    # The schema of a table does not change, so it is built for its first
+    # load only
+    if table not in ctx.bigquery_schemas:
+        ctx.bigquery_schemas[table] = build_schema(
+            ctx.schemas[table],
+            key_properties=ctx.key_properties[table],
         )
+    load_config.schema = ctx.bigquery_schemas[table]
+    load_config.source_format = SourceFormat.NEWLINE_DELIMITED_JSON
+
+    # Overwrite the table if truncate is enabled, these tables are loaded at
+    # once
+    if truncates_table(ctx, table):
+        LOGGER.info(f'Load {table} by FULL_TABLE')
+        load_config.write_disposition = WriteDisposition.WRITE_TRUNCATE
+
+    # Finish the gzip stream, the underlying temp file stays open to load it
+    temp_file: BinaryIO = ctx.rows[table]
+    if isinstance(temp_file, gzip.GzipFile):
+        gzip_file: gzip.GzipFile = temp_file
+        temp_file = gzip_file.fileobj
+        gzip_file.close()
+
+    ctx.loads[table].append(
+        ctx.executor.submit(
+            load_table,
+            ctx.client,
+            ctx.dataset,
+            table,
+            temp_file,
+            load_config,
+        ),
+    )
+
+
+def truncates_table(ctx: SimpleNamespace, table: str) -> bool:
+    """Check whether the load of a table overwrites it.
+
+    Arguments:
+        ctx {SimpleNamespace} -- Context of persist_lines_job
+        table {str} -- Table name
 
-    yield state
+    Returns:
+        bool -- Whether the table is truncated
+    """
+    return ctx.truncate or table in ctx.forced_fulltables
+
+
+def load_table(
+    client: Client,
+    dataset: Dataset,
+    table: str,
+    temp_file: BinaryIO,
+    load_config: LoadJobConfig,
+) -> None:
+    """Load a temp file into a BigQuery table and wait for the job.
+
+    Arguments:
+        client {Client} -- BigQuery client
+        dataset {Dataset} -- BigQuery dataset
+        table {str} -- Table name
+        temp_file {BinaryIO} -- File with newline delimited JSON records,
+        optionally gzipped
+        load_config {LoadJobConfig} -- Load job configuration
+
+    Raises:
+        GoogleAPICallError: If the load job failed
+    """
+    LOGGER.info(f'loading {table} to Bigquery.')
+
+    # Setup load job
+    load_job: LoadJob = client.load_table_from_file(
+        temp_file,
+        dataset.table(table),
+        job_config=load_config,
+        rewind=True,
+    )
+
+    LOGGER.info(f'loading job {load_job.job_id}')
+
+    # Run load job
+    try:
+        load_job.result()
+    except google_exceptions.GoogleAPICallError as err:
+        # Parse errors
+        LOGGER.error(f'failed to load table {table} from file: {err}')
+
+        if load_job.errors:
+            messages: list = [
+                f"reason: {err['reason']}, message: {err['message']}"
+                for err in load_job.errors
+            ]
+            messages_str: str = '\n'.join(messages)
+            LOGGER.error(f'errors:\n{messages_str}')
+        raise
+    LOGGER.info(
+        f'Loaded {load_job.output_rows} row(s) in '
+        f'{load_job.destination}',
+    )
+
+
+def open_temp_file(compress: bool) -> BinaryIO:
+    """Open a temp file to write records to, optionally gzip compressed.
+
+    The records are small, so a large buffer limits the amount of writes.
+    BigQuery detects the compression itself when loading the file, the fastest
+    compression level already shrinks the upload several times.
+
+    Arguments:
+        compress {bool} -- Whether to gzip the records
+
+    Returns:
+        BinaryIO -- Temp file, a gzip.GzipFile when compressed
+    """
+    temp_file: BinaryIO = TemporaryFile(
+        mode='w+b',
+        buffering=FILE_BUFFER_SIZE,
+    )
+    if not compress:
+        return temp_file
+
+    return gzip.GzipFile(
+        fileobj=temp_file,
+        mode='wb',
+        compresslevel=COMPRESS_LEVEL,
+    )
+
+
+def write_records(temp_file: BinaryIO, records: list) -> None:
+    """Write records as newline delimited JSON to a file.
+
+    Arguments:
+        temp_file {BinaryIO} -- File to write to
+        records {list} -- Records to write
+    """
+    # Somewhere in the process, the input record can have decimal values e.g.
+    # "value": Decimal('10.25'). These are not JSON serializable, so they are
+    # converted to string while dumping the records as newline delimited JSON
+    temp_file.write(b''.join([json_line(record) for record in records]))
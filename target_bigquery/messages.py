@@ -0,0 +1,72 @@
+"""Singer messages."""
+# -*- coding: utf-8 -*-
+import decimal
+import logging
+from typing import Any, Optional, Union
+
+import msgspec
+from singer import get_logger
+
+from target_bigquery.exceptions import InvalidSingerMessage
+
+LOGGER: logging.RootLogger = get_logger()
+
+
+class SchemaMessage(msgspec.Struct, tag_field='type', tag='SCHEMA'):
+    """Singer schema message."""
+
+    stream: str
+    schema: dict
+    key_properties: Optional[list] = None
+
+
+class RecordMessage(msgspec.Struct, tag_field='type', tag='RECORD'):
+    """Singer record message."""
+
+    stream: str
+    record: Any
+
+
+class StateMessage(msgspec.Struct, tag_field='type', tag='STATE'):
+    """Singer state message."""
+
+    value: Any
+
+
+Message = Union[SchemaMessage, RecordMessage, StateMessage]
+
+# Numbers are decoded as Decimal to keep their precision
+MESSAGE_DECODER: msgspec.json.Decoder = msgspec.json.Decoder(
+    Message,
+    float_hook=decimal.Decimal,
+)
+
+# States are emitted back to the tap, so their numbers have to stay numbers
+STATE_DECODER: msgspec.json.Decoder = msgspec.json.Decoder(StateMessage)
+
+
+def parse_message(line: Union[str, bytes]) -> Message:
+    """Parse a Singer message.
+
+    Arguments:
+        line {Union[str, bytes]} -- JSON encoded Singer message
+
+    Raises:
+        InvalidSingerMessage: Unknown message type or invalid message
+        DecodeError: Malformed JSON
+
+    Returns:
+        Message -- Schema, record or state message
+    """
+    try:
+        msg: Message = MESSAGE_DECODER.decode(line)
+        if type(msg) is StateMessage:
+            return STATE_DECODER.decode(line)
+    except msgspec.ValidationError as err:
+        raise InvalidSingerMessage(
+            f'Unrecognized Singer Message:\n {line}\n{err}',
+        ) from err
+    except msgspec.DecodeError:
+        LOGGER.error(f'Unable to parse Singer Message:\n{line}')
+        raise
+    return msg
@@ -2,12 +2,39 @@
 # -*- coding: utf-8 -*-
 
 import re
-from typing import Optional, Union
+from typing import Any, Callable, Optional, Union
 
 from google.cloud.bigquery import SchemaField
+from jsonschema.validators import validator_for
+
+from target_bigquery.encoders import decimal_to_str
 
 JSON_SCHEMA_LITERALS: tuple = ('boolean', 'number', 'integer', 'string')
 
+# Characters in a key that are illegal in BigQuery: a leading digit, dashes
+# and dots
+ILLEGAL_KEY_CHARACTERS: re.Pattern = re.compile(r'^\d|[-.]')
+
+# Schema keywords that do not constrain the validated records
+ANNOTATION_KEYWORDS: frozenset = frozenset((
+    '$schema',
+    '$id',
+    'id',
+    '$comment',
+    'title',
+    'description',
+    'default',
+    'examples',
+    'definitions',
+))
+
+# Node types of a compiled schema filter
+FILTER_LITERAL: int = 0
+FILTER_OBJECT: int = 1
+FILTER_ARRAY: int = 2
+FILTER_NULL: int = 3
+FILTER_INVALID: int = 4
+
 
 def get_type(prop: dict) -> tuple:
     """Retrieve the type of the property.
@@ -50,6 +77,45 @@ def get_type(prop: dict) -> tuple:
     return field_type, nullable
 
 
+def build_validator(schema: dict) -> Optional[Any]:
+    """Build a JSON schema validator, to validate many records against.
+
+    Arguments:
+        schema {dict} -- Input schema
+
+    Raises:
+        SchemaError: If the schema itself is invalid
+
+    Returns:
+        Optional[Any] -- Validator for the schema draft, None when the schema
+        accepts every record
+    """
+    if is_trivial_schema(schema):
+        return None
+
+    validator_class: Any = validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
+
+def is_trivial_schema(schema: dict) -> bool:
+    """Check whether a schema accepts every record.
+
+    Arguments:
+        schema {dict} -- Input schema
+
+    Returns:
+        bool -- Whether the schema only contains annotations
+    """
+    keywords: set = schema.keys() - ANNOTATION_KEYWORDS
+
+    # Additional properties are allowed by default
+    if schema.get('additionalProperties') is True:
+        keywords.discard('additionalProperties')
+
+    return not keywords
+
+
 def filter_schema(  # noqa: WPS210, WPS212, WPS231
     schema: dict,
     record: Optional[dict],
@@ -125,6 +191,167 @@ def filter_schema(  # noqa: WPS210, WPS212, WPS231
         raise ValueError(f'type {field_type} is unknown')
 
 
+def compile_schema(schema: dict) -> tuple:  # noqa: WPS212, WPS231
+    """Compile the schema into a filter, to filter many records with.
+
+    The compiled filter holds the result of the schema lookups done by
+    filter_schema, so they do not have to be repeated for every record.
+
+    Arguments:
+        schema {dict} -- Input schema
+
+    Returns:
+        tuple -- The compiled filter
+    """
+    try:
+        field_type, _ = get_type(schema)
+    except ValueError as err:
+        # Only raise when a record actually hits this part of the schema
+        return (FILTER_INVALID, str(err))
+
+    # return literals without checking
+    if field_type in JSON_SCHEMA_LITERALS:
+        return (FILTER_LITERAL,)
+
+    elif field_type == 'anyOf':
+        # Parse anyOf, choosing the first type that is not 'null'
+        for prop in schema['anyOf']:
+            try:
+                prop_type, _ = get_type(prop)
+            except ValueError as err:
+                return (FILTER_INVALID, str(err))
+
+            if prop_type == 'null':
+                continue
+
+            return compile_schema(prop)
+
+        return (FILTER_NULL,)
+
+    elif field_type == 'object':
+        # Parse an object, also keep the keys of the literal fields
+        props: dict = schema.get('properties', {})
+        children: tuple = tuple(
+            (key, compile_schema(prop_schema))
+            for key, prop_schema in props.items()
+        )
+        literal_keys: frozenset = frozenset(
+            key for key, child in children if child[0] == FILTER_LITERAL
+        )
+        return (FILTER_OBJECT, children, literal_keys)
+
+    elif field_type == 'array':
+        # Parse an array, only arrays of objects have to be filtered
+        props = schema.get('items', {})
+
+        try:
+            prop_type, _ = get_type(props)
+        except ValueError as err:
+            return (FILTER_INVALID, str(err))
+
+        if prop_type != 'object':
+            return (FILTER_LITERAL,)
+
+        return (FILTER_ARRAY, compile_schema(props))
+
+    return (FILTER_INVALID, f'type {field_type} is unknown')
+
+
+def apply_compiled(  # noqa: WPS210, WPS231
+    compiled: tuple,
+    record: Optional[dict],
+    json_compatible: bool = False,
+) -> Optional[Union[dict, str, list]]:
+    """Filter the record with a compiled schema.
+
+    Produces the same result as filter_schema, but walks the record with an
+    explicit stack instead of recursing into every nested field.
+
+    Arguments:
+        compiled {tuple} -- Schema compiled by compile_schema
+        record {Optional[dict]} -- Input record
+
+    Keyword Arguments:
+        json_compatible {bool} -- Whether to convert Decimal values to string
+        while filtering (default: {False})
+
+    Raises:
+        ValueError: If the field type is unknnown
+
+    Returns:
+        Optional[Union[dict, str, list]] -- The filtered record
+    """
+    # Decimals are converted while the values are copied, so the record does
+    # not have to be walked again afterwards
+    copy_value: Callable = decimal_to_str if json_compatible else keep_value
+
+    # The filtered values are assigned to a slot in their parent container
+    root: list = [None]
+    stack: list = [(compiled, record, root, 0)]
+
+    while stack:
+        node, input_value, container, slot = stack.pop()
+        node_type: int = node[0]
+
+        if not input_value or node_type == FILTER_LITERAL:
+            container[slot] = copy_value(input_value)
+
+        elif node_type == FILTER_OBJECT:
+            # When all fields are literals in the schema, filtering would
+            # rebuild the same object
+            if isinstance(input_value, dict) and node[2].issuperset(
+                input_value,
+            ):
+                container[slot] = copy_value(input_value)
+                continue
+
+            obj_result: dict = {}
+            container[slot] = obj_result
+            children: list = []
+
+            for key, child in node[1]:
+                if key not in input_value:
+                    continue
+
+                # Literals are copied directly, others are filtered later.
+                # The key is set right away to keep the order of the schema
+                if child[0] == FILTER_LITERAL:
+                    obj_result[key] = copy_value(input_value[key])
+                else:
+                    obj_result[key] = None
+                    children.append((child, input_value[key], obj_result, key))
+
+            # Push in reverse, so fields are filtered in the schema order
+            stack.extend(reversed(children))
+
+        elif node_type == FILTER_ARRAY:
+            arr_result: list = list(input_value)
+            container[slot] = arr_result
+
+            for index in reversed(range(len(arr_result))):
+                stack.append((node[1], arr_result[index], arr_result, index))
+
+        elif node_type == FILTER_NULL:
+            container[slot] = None
+
+        else:
+            raise ValueError(node[1])
+
+    return root[0]
+
+
+def keep_value(input_value: Any) -> Any:
+    """Return the value unchanged, when apply_compiled does not convert it.
+
+    Arguments:
+        input_value {Any} -- Input value
+
+    Returns:
+        Any -- The same value
+    """
+    return input_value
+
+
 def define_schema(  # noqa: 231
     field: dict,
     name: str,
@@ -256,10 +483,11 @@ def bigquery_transformed_key(key: str) -> str:
     Returns:
         str -- Transformed key
     """
-    for pattern, repl in (('-', '_'), (r'^\d', '_'), (r'\.', '_')):
-        key = re.sub(pattern, repl, key)
-
-    return key
+    # Most keys are already legal, identifiers can not start with a digit or
+    # contain a dash or dot
+    if key.isidentifier():
+        return key
+    return ILLEGAL_KEY_CHARACTERS.sub('_', key)
 
 
 def build_schema(
@@ -1,203 +1,504 @@
 """Streaming data into BigQuery."""
 # -*- coding: utf-8 -*-
-import json
 import logging
 import time
-from typing import Iterator, Optional, TextIO, Union
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, BinaryIO, Iterable, Iterator, Optional, Union
 
 from google.cloud import bigquery
 from google.cloud.bigquery.client import Client
 from google.cloud.bigquery.dataset import Dataset
-from google.cloud.bigquery.table import TableReference
-from jsonschema import validate
-from singer import (  # noqa: I001
-    get_logger,  # noqa: I001
-    parse_message,  # noqa: I001
+from singer import get_logger
+
+from target_bigquery.encoders import json_line
+from target_bigquery.exceptions import SchemaNotFoundException
+from target_bigquery.messages import (  # noqa: I001
+    Message,  # noqa: I001
     RecordMessage,  # noqa: I001
     SchemaMessage,  # noqa: I001
     StateMessage,  # noqa: I001
+    parse_message,  # noqa: I001
 )  # noqa: I001
-
-from target_bigquery.encoders import DecimalEncoder
-from target_bigquery.exceptions import (  # noqa: I001
-    InvalidSingerMessage,  # noqa: I001
-    SchemaNotFoundException,  # noqa: I001
+from target_bigquery.schema import (  # noqa: I001
+    apply_compiled,  # noqa: I001
+    build_schema,  # noqa: I001
+    build_validator,  # noqa: I001
+    compile_schema,  # noqa: I001
 )  # noqa: I001
-from target_bigquery.schema import build_schema, filter_schema
 from target_bigquery.tools import table_exists
 
 LOGGER: logging.RootLogger = get_logger()
 FIVE_MINUTES: int = 300
+MAX_BATCH_SIZE: int = 50000
+
+# BigQuery rejects insert requests over 10 MB. The client sends the rows with
+# an insert id and a bit more whitespace than they are measured with, the
+# rest of the 10 MB leaves room for that
+MAX_REQUEST_BYTES: int = 9 * 1024 * 1024
+INSERT_ROW_OVERHEAD: int = 80
+
+# Serialized size of the rows kept for a recreated table while it waits. In
+# memory the rows take a few times more
+MAX_WAITING_BYTES: int = 64 * 1024 * 1024
 
 
 def persist_lines_stream(  # noqa: 211
     client: Client,
     project_id,
     dataset: Dataset,
-    lines: TextIO,
+    lines: BinaryIO,
     truncate: bool,
-    forced_fulltables: list,
+    forced_fulltables: Optional[Iterable[str]] = None,
     validate_records: bool = True,
     table_suffix: Optional[str] = None,
     table_prefix: Optional[str] = None,
+    batch_size: int = 500,
+    flush_interval: float = 5,
+    max_parallel_inserts: int = 8,
 ) -> Iterator[Optional[str]]:
     """Stream data into BigQuery.
 
     Arguments:
         client {Client} -- BigQuery client
         dataset {Dataset} -- BigQuery dataset
-        lines {TextIO} -- Tap stream
+        lines {BinaryIO} -- Tap stream
 
     Keyword Arguments:
         truncate {bool} -- Whether to truncunate the table
-        forced_fulltables {list} -- List of tables to truncunate
+        forced_fulltables {Optional[Iterable[str]]} -- Tables to truncunate
+        (default: {None})
         validate_records {bool} -- Whether to alidate records (default: {True})
         table_suffix {Optional[str]} -- Suffix for tables (default: {None})
         table_prefix {Optional[str]} -- Prefix for tables (default: {None})
+        batch_size {int} -- Max rows per insert request. A request is also
+        limited to 9 MB, so with larger rows it holds fewer rows. BigQuery
+        recommends about 500 rows (default: {500})
+        flush_interval {float} -- Max seconds between inserts (default: {5})
+        max_parallel_inserts {int} -- Insert requests that run at the same
+        time (default: {8})
 
     Raises:
-        SchemaNotFoundException: If the schema message was not received yet
         InvalidSingerMessage: Invalid Sinnger message
 
     Yields:
         Iterator[Optional[str]] -- State
     """
-    # Create variable in which we save data in the upcomming loop
-    state: Optional[str] = None
-    schemas: dict = {}
-    key_properties: dict = {}
-    tables: dict = {}
-    rows: dict = {}
-    errors: dict = {}
-    table_suffix = table_suffix or ''
-    table_prefix = table_prefix or ''
-
-    # For every Singer input message
-    for line in lines:
-        # Parse the message
-        try:
-            msg: Union[SchemaMessage, StateMessage, RecordMessage] = (
-                parse_message(line)
-            )
-        except json.decoder.JSONDecodeError:
-            LOGGER.error(f'Unable to parse Singer Message:\n{line}')
-            raise
-
-        # There can be several kind of messages. When inserting data, the
-        # schema message comes first
-        if isinstance(msg, SchemaMessage):
-            # Schema message, create the table
-            table_name: str = table_prefix + msg.stream + table_suffix
-
-            # Save the schema, key_properties and message to use in the
-            # record messages that are following
-            schemas[table_name] = msg.schema
-            key_properties[table_name] = msg.key_properties
-
-            tables[table_name] = bigquery.Table(
-                dataset.table(table_name),
-                schema=build_schema(schemas[table_name]),
-            )
+    # BigQuery rejects insert requests with more rows. The requests are split
+    # on MAX_REQUEST_BYTES as well, which with rows over 200 bytes limits
+    # them to fewer rows than this
+    if batch_size > MAX_BATCH_SIZE:
+        LOGGER.warning(
+            f'batch_size {batch_size} exceeds the BigQuery limit of '
+            f'{MAX_BATCH_SIZE} rows per request, using {MAX_BATCH_SIZE}. '
+            'Requests are also limited to 9 MB, so they hold fewer rows '
+            'unless the rows are small',
+        )
+        batch_size = MAX_BATCH_SIZE
 
-            rows[table_name] = 0
-            errors[table_name] = None
-
-            dataset_id: str = dataset.dataset_id
-            if not table_exists(client, project_id, dataset_id, table_name):
-                # Create the table
-                client.create_table(tables[table_name])
-            elif truncate or table_name in forced_fulltables:
-                LOGGER.info(f'Load {table_name} by FULL_TABLE')
-
-                # When truncating is enabled and the table exists, the table
-                # has to be recreated. Because of this, we have to wait
-                # otherwise data can be lost, see:
-                # https://stackoverflow.com/questions/36846571/
-                # bigquery-table-truncation-before-streaming-not-working
-                LOGGER.info(f'Deleting table {table_name} because it exists')
-                client.delete_table(tables[table_name])
-                LOGGER.info(f'Recreating table {table_name}')
-                client.create_table(tables[table_name])
-                LOGGER.info(
-                    'Sleeping for 5 minutes before streaming data, '
-                    f'to avoid streaming data loss in {table_name}',
-                )
-                time.sleep(FIVE_MINUTES)
-
-                # Delete table
-
-        elif isinstance(msg, RecordMessage):
-            # Record message
-            table_name = table_prefix + msg.stream + table_suffix
-
-            if table_name not in schemas:
-                raise SchemaNotFoundException(
-                    f'A record for stream {table_name} was encountered before '
-                    'a corresponding schema',
-                )
-
-            # Retrieve schema
-            schema: dict = schemas[table_name]
-
-            # Retrieve table
-            table_ref: TableReference = tables[table_name]
-
-            # Validate the record
-            if validate_records:
-                # Raises ValidationError if the record has invalid schema
-                validate(msg.record, schema)
-
-            # Filter the record
-            record_input: Optional[Union[dict, str, list]] = filter_schema(
-                schema,
-                msg.record,
-            )
+    # Create the context in which we save data in the upcomming loop
+    ctx: SimpleNamespace = SimpleNamespace(
+        client=client,
+        project_id=project_id,
+        dataset=dataset,
+        truncate=truncate,
+        forced_fulltables=frozenset(forced_fulltables or ()),
+        validate_records=validate_records,
+        table_suffix=table_suffix or '',
+        table_prefix=table_prefix or '',
+        batch_size=batch_size,
+        flush_interval=flush_interval,
+        max_parallel_inserts=max_parallel_inserts,
+        executor=None,
+        state=None,
+        table_names={},
+        schemas={},
+        key_properties={},
+        validators={},
+        filters={},
+        tables={},
+        rows={},
+        errors={},
+        pending={},
+        pending_sizes={},
+        pending_bytes={},
+        flushed_at={},
+        ready_at={},
+        inserts=[],
+        state_held=False,
+        state_blockers=set(),
+    )
 
-            # Somewhere in the process, the input record can have decimal
-            # values e.g. "value": Decimal('10.25'). These are not JSON
-            # erializable. Therefore, we dump the JSON here, which converts
-            # them to string. Thereafter, we load the dumped JSON so we get a
-            # dictionary again, which we can insert to BigQuery
-            record_json: str = json.dumps(record_input, cls=DecimalEncoder)
-            record: dict = json.loads(record_json)
-
-            # Save the error
-            err: Optional[list] = None
-
-            try:
-                # Insert record
-                err = client.insert_rows(table_ref, [record])
-            except Exception as exc:
-                LOGGER.error(
-                    f'Failed to insert rows for {table_name}: {exc}\n'
-                    f'{record}\n{err}',
-                )
-                raise
-
-            # Save errors of the stream and increate the insert rows
-            errors[msg.stream] = err
-            rows[msg.stream] += 1
-
-            state = None
-
-        elif isinstance(msg, StateMessage):
-            # State messages
-            LOGGER.debug(f'Setting state to {msg.value}')
-            state = msg.value
+    # There can be several kind of messages, each has its own handler
+    handlers: dict = {
+        SchemaMessage: handle_schema_message,
+        RecordMessage: handle_record_message,
+        StateMessage: handle_state_message,
+    }
 
-        else:
-            raise InvalidSingerMessage(f'Unrecognized Singer Message:\n {msg}')
+    with ThreadPoolExecutor(max_workers=max_parallel_inserts) as executor:
+        ctx.executor = executor
+
+        # For every Singer input message
+        for line in lines:
+            # Parse the message, unknown message types raise
+            # InvalidSingerMessage
+            msg: Message = parse_message(line)
+            handlers[type(msg)](msg, ctx)
+
+            # Insert the rows of recreated tables once their wait is over
+            if ctx.ready_at:
+                release_tables(ctx)
+
+            # The state is emitted once the rows received before it are
+            # inserted, so the tap can continue from the state
+            if ctx.state_held and not ctx.state_blockers:
+                if release_state(ctx):
+                    yield ctx.state
 
-    for table in errors.keys():
-        if errors[table]:
-            logging.error(f'Errors: {errors[table]}')
+        # Insert the rows that are left
+        for table in list(ctx.ready_at.keys()):
+            wait_for_table(ctx, table)
+        for table in ctx.pending.keys():
+            flush_rows(ctx, table)
+        collect_inserts(ctx)
+
+        if ctx.state_held and release_state(ctx):
+            yield ctx.state
+
+    for table in ctx.errors.keys():
+        if ctx.errors[table]:
+            logging.error(f'Errors: {ctx.errors[table]}')
         else:
             logging.info(
                 'Loaded {rows} row(s) from {source} into {tab}:{path}'.format(
-                    rows=rows[table],
+                    rows=ctx.rows[table],
                     source=dataset.dataset_id,
                     tab=table,
-                    path=tables[table].path,
+                    path=ctx.tables[table].path,
                 ),
             )
-            yield state
+
+
+def handle_schema_message(msg: SchemaMessage, ctx: SimpleNamespace) -> None:
+    """Save the schema of a stream and create its table.
+
+    When inserting data, the schema message comes first.
+
+    Arguments:
+        msg {SchemaMessage} -- Schema message
+        ctx {SimpleNamespace} -- Context of persist_lines_stream
+    """
+    # Build the table name once, the records of the stream look it up
+    table_name: str = ctx.table_prefix + msg.stream + ctx.table_suffix
+    ctx.table_names[msg.stream] = table_name
+
+    # Skip the schema if it did not change, the table is already set up
+    if ctx.schemas.get(table_name) == msg.schema:
+        return
+
+    # Save the schema, key_properties and message to use in the
+    # record messages that are following
+    ctx.schemas[table_name] = msg.schema
+    ctx.key_properties[table_name] = msg.key_properties
+    if ctx.validate_records:
+        ctx.validators[table_name] = build_validator(msg.schema)
+    ctx.filters[table_name] = compile_schema(msg.schema)
+
+    ctx.tables[table_name] = bigquery.Table(
+        ctx.dataset.table(table_name),
+        schema=build_schema(ctx.schemas[table_name]),
+    )
+
+    # The table only has to be checked, created or truncated the first time
+    # it is seen. Truncating it again would remove the rows streamed so far
+    if table_name in ctx.rows:
+        return
+
+    ctx.rows[table_name] = 0
+    ctx.errors[table_name] = []
+    ctx.pending[table_name] = []
+    ctx.pending_sizes[table_name] = []
+    ctx.pending_bytes[table_name] = 0
+    ctx.flushed_at[table_name] = time.monotonic()
+
+    client: Client = ctx.client
+    dataset_id: str = ctx.dataset.dataset_id
+    if not table_exists(client, ctx.project_id, dataset_id, table_name):
+        # Create the table
+        client.create_table(ctx.tables[table_name])
+    elif ctx.truncate or table_name in ctx.forced_fulltables:
+        LOGGER.info(f'Load {table_name} by FULL_TABLE')
+
+        # When truncating is enabled and the table exists, the table
+        # has to be recreated. Because of this, we have to wait
+        # otherwise data can be lost, see:
+        # https://stackoverflow.com/questions/36846571/
+        # bigquery-table-truncation-before-streaming-not-working
+        LOGGER.info(f'Deleting table {table_name} because it exists')
+        client.delete_table(ctx.tables[table_name])
+        LOGGER.info(f'Recreating table {table_name}')
+        client.create_table(ctx.tables[table_name])
+
+        # The wait starts now. The rows of the table are kept until it is
+        # over, meanwhile the input is read and the other tables are
+        # streamed to
+        ctx.ready_at[table_name] = time.monotonic() + FIVE_MINUTES
+
+
+def handle_record_message(msg: RecordMessage, ctx: SimpleNamespace) -> None:
+    """Filter a record and add it to the pending rows of its table.
+
+    Arguments:
+        msg {RecordMessage} -- Record message
+        ctx {SimpleNamespace} -- Context of persist_lines_stream
+
+    Raises:
+        SchemaNotFoundException: If the schema message was not received yet
+    """
+    table_name: Optional[str] = ctx.table_names.get(msg.stream)
+
+    if table_name is None:
+        raise SchemaNotFoundException(
+            f'A record for stream {msg.stream} was encountered before '
+            'a corresponding schema',
+        )
+
+    # Validate the record, there is no validator when validation is disabled
+    # or the schema accepts every record
+    validator: Optional[Any] = ctx.validators.get(table_name)
+    if validator is not None:
+        # Raises ValidationError if the record has invalid schema
+        validator.validate(msg.record)
+
+    # Filter the record. Somewhere in the process, the input record can have
+    # decimal values e.g. "value": Decimal('10.25'). These are not JSON
+    # serializable. Therefore, they are converted to string while filtering,
+    # before inserting the record into BigQuery
+    record: Optional[Union[dict, str, list]] = apply_compiled(
+        ctx.filters[table_name],
+        msg.record,
+        json_compatible=True,
+    )
+
+    # Save the record with its size, insert the batch once it is full or when
+    # the table has not been flushed for a while
+    size: int = len(json_line(record)) + INSERT_ROW_OVERHEAD
+    pending: list = ctx.pending[table_name]
+    pending.append(record)
+    ctx.pending_sizes[table_name].append(size)
+    ctx.pending_bytes[table_name] += size
+
+    # Limit the size of the rows that are kept for a recreated table
+    waiting: bool = table_name in ctx.ready_at
+    if waiting and ctx.pending_bytes[table_name] >= MAX_WAITING_BYTES:
+        wait_for_table(ctx, table_name)
+        return
+
+    elapsed: float = time.monotonic() - ctx.flushed_at[table_name]
+    batch_full: bool = (
+        len(pending) >= ctx.batch_size
+        or ctx.pending_bytes[table_name] >= MAX_REQUEST_BYTES
+    )
+    if batch_full or elapsed >= ctx.flush_interval:
+        flush_rows(ctx, table_name)
+
+
+def handle_state_message(msg: StateMessage, ctx: SimpleNamespace) -> None:
+    """Start inserting all rows received before the state and hold the state.
+
+    Arguments:
+        msg {StateMessage} -- State message
+        ctx {SimpleNamespace} -- Context of persist_lines_stream
+    """
+    # The state may only be emitted once its rows are inserted
+    for table in ctx.pending.keys():
+        flush_rows(ctx, table)
+
+    LOGGER.debug('Setting state to %s', msg.value)  # noqa: WPS323
+    ctx.state = msg.value
+    ctx.state_held = True
+
+    # The rows of recreated tables that still wait are inserted later, the
+    # state is held until then
+    ctx.state_blockers = {
+        table for table in ctx.ready_at.keys() if ctx.pending[table]
+    }
+
+
+def release_state(ctx: SimpleNamespace) -> bool:
+    """Wait for the inserts of the held state and check whether to emit it.
+
+    Arguments:
+        ctx {SimpleNamespace} -- Context of persist_lines_stream
+
+    Returns:
+        bool -- Whether the state can be emitted
+    """
+    collect_inserts(ctx)
+    ctx.state_held = False
+
+    # Once rows failed to insert, the states are withheld, so the tap does
+    # not skip the failed rows
+    if any(ctx.errors.values()):
+        LOGGER.warning('Not emitting the state, rows failed to insert')
+        return False
+    return True
+
+
+def release_tables(ctx: SimpleNamespace) -> None:
+    """Start inserting into the recreated tables whose wait is over.
+
+    Arguments:
+        ctx {SimpleNamespace} -- Context of persist_lines_stream
+    """
+    now: float = time.monotonic()
+    ready: list = [
+        table for table, ready_at in ctx.ready_at.items() if ready_at <= now
+    ]
+    for table_name in ready:
+        release_table(ctx, table_name)
+
+
+def wait_for_table(ctx: SimpleNamespace, table_name: str) -> None:
+    """Wait for a recreated table and start inserting its rows.
+
+    Arguments:
+        ctx {SimpleNamespace} -- Context of persist_lines_stream
+        table_name {str} -- Recreated table
+    """
+    # Wait for the rest of the 5 minutes after a table got recreated, to
+    # avoid streaming data loss. There is no need to wait without rows
+    wait: float = ctx.ready_at[table_name] - time.monotonic()
+    if wait > 0 and ctx.pending[table_name]:
+        LOGGER.info(
+            f'Sleeping for {wait:.0f} seconds before streaming data, '
+            f'to avoid streaming data loss in {table_name}',
+        )
+        time.sleep(wait)
+
+    release_table(ctx, table_name)
+
+
+def release_table(ctx: SimpleNamespace, table_name: str) -> None:
+    """Start inserting the rows that were kept for a recreated table.
+
+    Arguments:
+        ctx {SimpleNamespace} -- Context of persist_lines_stream
+        table_name {str} -- Recreated table
+    """
+    del ctx.ready_at[table_name]  # noqa: WPS420
+    ctx.state_blockers.discard(table_name)
+    flush_rows(ctx, table_name)
+
+
+def flush_rows(ctx: SimpleNamespace, table_name: str) -> None:
+    """Start inserting the pending rows of a table into BigQuery.
+
+    The rows of a recreated table are kept until its wait is over.
+
+    Arguments:
+        ctx {SimpleNamespace} -- Context of persist_lines_stream
+        table_name {str} -- Table to insert the pending rows into
+    """
+    ctx.flushed_at[table_name] = time.monotonic()
+
+    rows: list = ctx.pending[table_name]
+    if not rows or table_name in ctx.ready_at:
+        return
+
+    # The rows are handed over to the inserts, new records go to a new list.
+    # The rows kept for a recreated table can be more than one batch
+    sizes: list = ctx.pending_sizes[table_name]
+    ctx.pending[table_name] = []
+    ctx.pending_sizes[table_name] = []
+    ctx.pending_bytes[table_name] = 0
+    for batch in split_batches(rows, sizes, ctx.batch_size):
+        ctx.inserts.append((
+            table_name,
+            len(batch),
+            ctx.executor.submit(
+                insert_rows,
+                ctx.client,
+                ctx.tables[table_name],
+                batch,
+            ),
+        ))
+
+        # Limit the amount of batches that are kept in memory
+        collect_inserts(ctx, limit=ctx.max_parallel_inserts)
+
+
+def split_batches(rows: list, sizes: list, batch_size: int) -> Iterator[list]:
+    """Split rows into batches that fit in one insert request.
+
+    Arguments:
+        rows {list} -- Rows to split
+        sizes {list} -- Size of every row in bytes
+        batch_size {int} -- Rows per batch
+
+    Yields:
+        Iterator[list] -- Batch of at most batch_size rows and
+        MAX_REQUEST_BYTES bytes, a larger row is sent on its own
+    """
+    start: int = 0
+    batch_bytes: int = 0
+    for index, size in enumerate(sizes):
+        batch_full: bool = index - start >= batch_size or (
+            index > start and batch_bytes + size > MAX_REQUEST_BYTES
+        )
+        if batch_full:
+            yield rows[start:index]
+            start = index
+            batch_bytes = 0
+        batch_bytes += size
+
+    if start < len(rows):
+        yield rows[start:]
+
+
+def collect_inserts(ctx: SimpleNamespace, limit: int = 0) -> None:
+    """Wait for the oldest inserts, until at most limit inserts are running.
+
+    Arguments:
+        ctx {SimpleNamespace} -- Context of persist_lines_stream
+
+    Keyword Arguments:
+        limit {int} -- Inserts that may keep running (default: {0})
+
+    Raises:
+        Exception: If an insert failed
+    """
+    while len(ctx.inserts) > limit:
+        table_name, row_count, future = ctx.inserts.pop(0)
+
+        # Save errors of the table and increase the inserted rows
+        ctx.errors[table_name].extend(future.result())
+        ctx.rows[table_name] += row_count
+
+
+def insert_rows(client: Client, table: bigquery.Table, batch: list) -> list:
+    """Insert rows into a BigQuery table.
+
+    Arguments:
+        client {Client} -- BigQuery client
+        table {bigquery.Table} -- Table to insert the rows into
+        batch {list} -- Rows to insert
+
+    Raises:
+        Exception: If the insert request failed
+
+    Returns:
+        list -- Errors of the rows that could not be inserted
+    """
+    try:
+        # Insert rows, the records are already JSON compatible so they do not
+        # have to be converted using the table schema
+        return client.insert_rows_json(table, batch)
+    except Exception as exc:
+        LOGGER.error(
+            'Failed to insert rows for %s: %s',  # noqa: WPS323
+            table.table_id,
+            exc,
+        )
+        raise
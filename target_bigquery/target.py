@@ -5,22 +5,27 @@ import io
 import logging
 import sys
 from argparse import ArgumentParser, Namespace
-from typing import Iterator, Optional, TextIO, Tuple
+from importlib.metadata import version
+from typing import TYPE_CHECKING, BinaryIO, Iterator, Optional, Tuple
 
-import pkg_resources
-from google.cloud import bigquery
-from google.cloud.bigquery.client import Client
-from google.cloud.bigquery.dataset import Dataset
 from oauth2client import tools
 from singer import get_logger, utils
 
-from target_bigquery.job import persist_lines_job
-from target_bigquery.stream import persist_lines_stream
-from target_bigquery.tools import dataset_exists, emit_state
+# The Google libraries take a while to import. They are imported once they are
+# used, so printing the help or an invalid config exits right away
+if TYPE_CHECKING:
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud.bigquery.client import Client
+    from google.cloud.bigquery.dataset import Dataset
 
-VERSION: str = pkg_resources.get_distribution('target-bigquery').version
+VERSION: str = version('target-bigquery')
 LOGGER: logging.RootLogger = get_logger()
 REQUIRED_CONFIG_KEYS: tuple = ('project_id', 'dataset_id')
+INPUT_BUFFER_SIZE: int = 1024 * 1024
+HTTP_POOL_CONNECTIONS: int = 8
+HTTP_POOL_SIZE: int = 32
+HTTP_RETRIES: int = 3
+HTTP_RETRY_STATUSES: tuple = (429, 500, 502, 503, 504)
 
 # Disable google cache logger message
 logging.getLogger('googleapiclient.discovery_cache').setLevel(logging.ERROR)
@@ -38,6 +43,10 @@ def main() -> None:  # noqa: WPS210
 
     LOGGER.info(f'>>> Running target-bigquery v{VERSION}')
 
+    from target_bigquery.job import persist_lines_job  # noqa: WPS433
+    from target_bigquery.stream import persist_lines_stream  # noqa: WPS433
+    from target_bigquery.tools import emit_state  # noqa: WPS433
+
     # Configuration variables
     config = args.config
 
@@ -49,6 +58,11 @@ def main() -> None:  # noqa: WPS210
     validate_records: bool = config.get('validate_records', True)
     project_id, dataset_id = config['project_id'], config['dataset_id']
     stream_data: bool = config.get('stream_data', True)
+    batch_size: int = config.get('batch_size', 500)
+    flush_interval: float = config.get('flush_interval', 5)
+    max_parallel_inserts: int = config.get('max_parallel_inserts', 8)
+    max_file_size: Optional[int] = config.get('max_file_size')
+    compress_files: bool = config.get('compress_files', False)
 
     LOGGER.info(
         f'BigQuery target configured to move data to '  # noqa: WPS221
@@ -56,14 +70,22 @@ def main() -> None:  # noqa: WPS210
         f'table_prefix={table_prefix}, stream_data={stream_data}, '
         f'location={location}, validate_records={validate_records}, '
         f'forced_fulltables={forced_fulltables}, '
-        f'replication_method={truncate}',
+        f'replication_method={truncate}, batch_size={batch_size}, '
+        f'flush_interval={flush_interval}, '
+        f'max_parallel_inserts={max_parallel_inserts}, '
+        f'max_file_size={max_file_size}, compress_files={compress_files}',
     )
 
     # Create dataset if not exists
     client, dataset = ensure_dataset(project_id, dataset_id, location)
 
-    # Input data from the tap
-    input_target: TextIO = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    # Input data from the tap, read in large chunks to limit the amount of
+    # reads from stdin. The lines are decoded as bytes, without decoding them
+    # to text first
+    input_target: BinaryIO = io.BufferedReader(
+        sys.stdin.buffer.raw,
+        buffer_size=INPUT_BUFFER_SIZE,
+    )
 
     if stream_data:
         state_iterator: Iterator = persist_lines_stream(
@@ -76,6 +98,9 @@ def main() -> None:  # noqa: WPS210
             validate_records=validate_records,
             table_suffix=table_suffix,
             table_prefix=table_prefix,
+            batch_size=batch_size,
+            flush_interval=flush_interval,
+            max_parallel_inserts=max_parallel_inserts,
         )
 
     else:
@@ -88,17 +113,23 @@ def main() -> None:  # noqa: WPS210
             validate_records=validate_records,
             table_suffix=table_suffix,
             table_prefix=table_prefix,
+            max_file_size=max_file_size,
+            compress_files=compress_files,
         )
 
     for state in state_iterator:
         emit_state(state)
 
+        # Write every state right away, so the state that is read while the
+        # target runs, or after it failed, is the latest one
+        sys.stdout.buffer.flush()
+
 
 def ensure_dataset(
     project_id: str,
     dataset_id: str,
     location: str,
-) -> Tuple[Client, Dataset]:
+) -> Tuple['Client', 'Dataset']:
     """Create BigQuery dataset if not exists.
 
     Arguments:
@@ -109,7 +140,16 @@ def ensure_dataset(
     Returns:
         Tuple[Client, Dataset] -- BigQuery Client and Dataset
     """
-    client: Client = bigquery.Client(project=project_id, location=location)
+    from google.cloud import bigquery  # noqa: WPS433
+    from google.cloud.bigquery.dataset import Dataset  # noqa: WPS433, WPS442
+
+    from target_bigquery.tools import dataset_exists  # noqa: WPS433
+
+    client: Client = bigquery.Client(
+        project=project_id,
+        location=location,
+        _http=build_session(),
+    )
 
     dataset_ref: Dataset = client.dataset(dataset_id)
 
@@ -130,5 +170,48 @@ def ensure_dataset(
     return client, Dataset(dataset_ref)
 
 
+def build_session() -> 'AuthorizedSession':
+    """Build an authorized HTTP session for the BigQuery client.
+
+    The session keeps a pool of connections open, so the requests to BigQuery
+    reuse them instead of setting up a new connection every time. Requests
+    that are throttled or hit a server error are retried on the same
+    connection pool with a short backoff. The client retries the API errors
+    itself on top of that, so only a few retries are done here.
+
+    Returns:
+        AuthorizedSession -- HTTP session with the default credentials
+    """
+    import google.auth  # noqa: WPS433, WPS301
+    from google.auth.transport.requests import (  # noqa: WPS433, WPS442
+        AuthorizedSession,
+    )
+    from google.cloud import bigquery  # noqa: WPS433
+    from requests.adapters import HTTPAdapter  # noqa: WPS433
+    from urllib3.util.retry import Retry  # noqa: WPS433
+
+    credentials, _ = google.auth.default(scopes=bigquery.Client.SCOPE)
+    session: AuthorizedSession = AuthorizedSession(credentials)
+    session.mount(
+        'https://',
+        HTTPAdapter(
+            pool_connections=HTTP_POOL_CONNECTIONS,
+            pool_maxsize=HTTP_POOL_SIZE,
+            max_retries=Retry(
+                total=HTTP_RETRIES,
+                # A request that timed out may have been processed, retrying
+                # it could insert the rows twice
+                read=0,
+                backoff_factor=0.5,
+                status_forcelist=HTTP_RETRY_STATUSES,
+                allowed_methods=frozenset(('GET', 'POST')),
+                # Return the last response, the client raises the API error
+                raise_on_status=False,
+            ),
+        ),
+    )
+    return session
+
+
 if __name__ == '__main__':
     main()
@@ -1,6 +1,5 @@
 """Tools."""
 # -*- coding: utf-8 -*-
-import json
 import logging
 import sys
 from typing import Optional
@@ -9,6 +8,8 @@ import singer
 from google.cloud.bigquery.client import Client
 from google.cloud.exceptions import NotFound
 
+from target_bigquery.encoders import json_line
+
 logger: logging.RootLogger = singer.get_logger()
 
 
@@ -19,10 +20,11 @@ def emit_state(state: Optional[dict]) -> None:
         state {Optional[dict]} -- State
     """
     if state is not None:
-        line: str = json.dumps(state)
-        logger.debug(f'Emitting state {line}')
-        sys.stdout.write(f'{line}\n')
-        sys.stdout.flush()
+        line: bytes = json_line(state)
+        logger.debug('Emitting state %s', state)  # noqa: WPS323
+
+        # Main flushes stdout after every state
+        sys.stdout.buffer.write(line)
 
 
 def dataset_exists(client: Client, dataset_id: str) -> bool:
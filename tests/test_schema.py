@@ -0,0 +1,90 @@
+"""Tests for filtering records with a schema."""
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+
+import pytest
+
+from target_bigquery.schema import (  # noqa: I001
+    apply_compiled,  # noqa: I001
+    compile_schema,  # noqa: I001
+    filter_schema,  # noqa: I001
+)  # noqa: I001
+
+ITEM_SCHEMA: dict = {
+    'type': 'object',
+    'properties': {
+        'sku': {'type': 'string'},
+        'price': {'type': ['null', 'number']},
+    },
+}
+
+SCHEMA: dict = {
+    'type': 'object',
+    'properties': {
+        'id': {'type': 'integer'},
+        'name': {'type': ['null', 'string']},
+        'tags': {'type': 'array', 'items': {'type': 'string'}},
+        'items': {'type': ['null', 'array'], 'items': ITEM_SCHEMA},
+        'address': {
+            'anyOf': [
+                {'type': 'null'},
+                {
+                    'type': 'object',
+                    'properties': {'city': {'type': 'string'}},
+                },
+            ],
+        },
+        'nothing': {'anyOf': [{'type': 'null'}]},
+    },
+}
+
+
+@pytest.mark.parametrize('record', [  # noqa: WPS317
+    {'id': 1, 'name': 'a', 'tags': ['x', 'y']},
+    {'id': 1, 'unknown': 'dropped'},
+    {'id': 1, 'name': None, 'items': None, 'address': None},
+    {
+        'id': 1,
+        'items': [
+            {'sku': 'a', 'price': Decimal('1.5'), 'unknown': 'dropped'},
+            {'sku': 'b', 'price': None},
+            {},
+        ],
+    },
+    {'id': 1, 'address': {'city': 'Wijchen', 'unknown': 'dropped'}},
+    {'id': 1, 'nothing': {'unknown': 'dropped'}},
+    {},
+    None,
+])
+def test_apply_compiled_matches_filter_schema(record):
+    """Filtering with a compiled schema gives the result of filter_schema."""
+    compiled: tuple = compile_schema(SCHEMA)
+
+    assert apply_compiled(compiled, record) == filter_schema(SCHEMA, record)
+
+
+def test_apply_compiled_converts_decimals():
+    """Decimals are converted to string for JSON compatible records."""
+    record: dict = {'id': 1, 'items': [{'price': Decimal('1.5')}]}
+
+    filtered: dict = apply_compiled(
+        compile_schema(SCHEMA),
+        record,
+        json_compatible=True,
+    )
+
+    assert filtered == {'id': 1, 'items': [{'price': '1.5'}]}
+
+
+@pytest.mark.parametrize('schema', [  # noqa: WPS317
+    {'type': 'object', 'properties': {'value': {'type': 'unknown'}}},
+    {'type': 'object', 'properties': {'value': {}}},
+])
+def test_apply_compiled_raises_on_unknown_types(schema):
+    """Both filters raise for a record that hits an unknown type."""
+    record: dict = {'value': {'key': 1}}
+
+    with pytest.raises(ValueError):
+        filter_schema(schema, record)
+    with pytest.raises(ValueError):
+        apply_compiled(compile_schema(schema), record)
@@ -0,0 +1,196 @@
+"""Tests for streaming data into BigQuery."""
+# -*- coding: utf-8 -*-
+from typing import Iterator, Optional
+
+import orjson
+from google.cloud.bigquery import Dataset, Table
+from google.cloud.exceptions import NotFound
+
+from target_bigquery import stream
+from target_bigquery.stream import persist_lines_stream
+
+SCHEMA: dict = {
+    'type': 'object',
+    'properties': {'id': {'type': 'integer'}},
+}
+
+
+class FakeClient(object):
+    """BigQuery client that keeps the tables and inserted rows in memory."""
+
+    def __init__(self, tables: Optional[list] = None) -> None:
+        """Set up the client.
+
+        Keyword Arguments:
+            tables {Optional[list]} -- Ids of tables that exist
+            (default: {None})
+        """
+        self.tables: set = set(tables or ())
+        self.rows: dict = {}
+
+    def get_table(self, table: str) -> str:
+        """Get a table by its full id.
+
+        Arguments:
+            table {str} -- Table id
+
+        Raises:
+            NotFound: If the table does not exist
+
+        Returns:
+            str -- Table id
+        """
+        if table.split('.')[-1] not in self.tables:
+            raise NotFound(table)
+        return table
+
+    def create_table(self, table: Table) -> None:
+        """Create a table.
+
+        Arguments:
+            table {Table} -- Table
+        """
+        self.tables.add(table.table_id)
+
+    def delete_table(self, table: Table) -> None:
+        """Delete a table with its rows.
+
+        Arguments:
+            table {Table} -- Table
+        """
+        self.tables.discard(table.table_id)
+        self.rows.pop(table.table_id, None)
+
+    def insert_rows_json(self, table: Table, rows: list) -> list:
+        """Insert rows into a table.
+
+        Arguments:
+            table {Table} -- Table
+            rows {list} -- Rows
+
+        Returns:
+            list -- Errors, there are none
+        """
+        self.rows.setdefault(table.table_id, []).extend(rows)
+        return []
+
+
+def messages(*lines: dict) -> Iterator[bytes]:
+    """Serialize Singer messages as input lines.
+
+    Arguments:
+        lines {dict} -- Singer messages
+
+    Yields:
+        Iterator[bytes] -- Input line
+    """
+    for line in lines:
+        yield orjson.dumps(line)
+
+
+def schema(stream_name: str) -> dict:
+    """Build a schema message.
+
+    Arguments:
+        stream_name {str} -- Stream
+
+    Returns:
+        dict -- Schema message
+    """
+    return {
+        'type': 'SCHEMA',
+        'stream': stream_name,
+        'schema': SCHEMA,
+        'key_properties': ['id'],
+    }
+
+
+def record(stream_name: str, record_id: int) -> dict:
+    """Build a record message.
+
+    Arguments:
+        stream_name {str} -- Stream
+        record_id {int} -- Id of the record
+
+    Returns:
+        dict -- Record message
+    """
+    return {
+        'type': 'RECORD',
+        'stream': stream_name,
+        'record': {'id': record_id},
+    }
+
+
+def state(bookmark: int) -> dict:
+    """Build a state message.
+
+    Arguments:
+        bookmark {int} -- Bookmark in the state
+
+    Returns:
+        dict -- State message
+    """
+    return {'type': 'STATE', 'value': {'bookmark': bookmark}}
+
+
+def test_stream_into_prefixed_tables():
+    """Rows go to the prefixed tables, every state is emitted once."""
+    client: FakeClient = FakeClient()
+    lines: Iterator[bytes] = messages(
+        schema('users'),
+        schema('orders'),
+        record('users', 1),
+        record('orders', 1),
+        record('users', 2),
+        state(1),
+        record('users', 3),
+        record('orders', 2),
+        state(2),
+    )
+
+    states: list = list(persist_lines_stream(
+        client,
+        'project',
+        Dataset('project.dataset'),
+        lines,
+        truncate=False,
+        table_prefix='p_',
+        batch_size=2,
+    ))
+
+    assert states == [{'bookmark': 1}, {'bookmark': 2}]
+    assert client.tables == {'p_users', 'p_orders'}
+    assert client.rows == {
+        'p_users': [{'id': 1}, {'id': 2}, {'id': 3}],
+        'p_orders': [{'id': 1}, {'id': 2}],
+    }
+
+
+def test_hold_state_until_recreated_table_is_ready(monkeypatch):
+    """The state is emitted once the rows of a recreated table are in."""
+    sleeps: list = []
+    monkeypatch.setattr(stream.time, 'sleep', sleeps.append)
+    client: FakeClient = FakeClient(tables=['users'])
+    lines: Iterator[bytes] = messages(
+        schema('users'),
+        record('users', 1),
+        state(1),
+        record('users', 2),
+        state(2),
+    )
+
+    states: Iterator = persist_lines_stream(
+        client,
+        'project',
+        Dataset('project.dataset'),
+        lines,
+        truncate=True,
+    )
+
+    # The rows are only inserted after the wait, then the latest state is
+    # emitted
+    assert next(states) == {'bookmark': 2}
+    assert len(sleeps) == 1
+    assert client.rows == {'users': [{'id': 1}, {'id': 2}]}
+    assert list(states) == []